@@ -4,73 +4,120 @@ Usage:
     python scripts/adjuster_report.py              # Print routing table + sync reports
     python scripts/adjuster_report.py --table       # Print routing table only
     python scripts/adjuster_report.py --sync        # Sync reports only
+
+Add --refresh-cache to re-read stack outputs after a `cdk deploy`.
 """
+import base64
 import json
 import os
+import queue
 import sys
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 
 import boto3
-from botocore.exceptions import ClientError
+from boto3.dynamodb.types import Binary
 
-from config import REGION, BUCKET_NAME
+from config import REGION, BUCKET_NAME, aws_client, cached_stack_outputs
 
 ADJUSTER_STACK = "OarcWsAdjusterStack"
 SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 PIPELINE_DIR = os.path.join(SCRIPT_DIR, "files", "reports", "pipeline")
 ADJUSTER_DIR = os.path.join(SCRIPT_DIR, "files", "reports", "adjuster")
+SCAN_SEGMENTS = 4
 
 
-def get_routing_table_name() -> str:
+def get_routing_table_name(refresh: bool = False) -> str:
     """Get DynamoDB routing table name from adjuster stack outputs."""
-    cfn = boto3.client("cloudformation", region_name=REGION)
+    return cached_stack_outputs(ADJUSTER_STACK, REGION, refresh=refresh).get("RoutingTableName")
+
+
+def _to_json(value):
+    """json.dumps default= hook for the DynamoDB types boto3 returns."""
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, set):
+        # Number and string sets sort natively (numbers numerically); Binary has no ordering
+        if any(isinstance(v, Binary) for v in value):
+            return sorted(value, key=str)
+        return sorted(value)
+    if isinstance(value, Binary):
+        value = value.value
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode("ascii")
+    return str(value)
+
+
+def _scan_segment(table_name: str, segment: int, total_segments: int, pages: queue.Queue):
+    """Scan one segment of a parallel scan, putting each page of items on `pages`.
+
+    Puts None when the segment is exhausted (or fails).
+    """
     try:
-        resp = cfn.describe_stacks(StackName=ADJUSTER_STACK)
-        for out in resp["Stacks"][0].get("Outputs", []):
-            if out.get("OutputKey") == "RoutingTableName":
-                return out["OutputValue"]
-    except ClientError:
-        pass
-    return None
-
-
-def scan_all(table_name: str) -> list:
-    """Scan entire DynamoDB table with pagination."""
+        # boto3 resources are not thread-safe, so each worker builds its own
+        table = boto3.session.Session().resource("dynamodb", region_name=REGION).Table(table_name)
+        kwargs = {"Segment": segment, "TotalSegments": total_segments}
+        while True:
+            resp = table.scan(**kwargs)
+            pages.put(resp.get("Items", []))
+            if "LastEvaluatedKey" not in resp:
+                break
+            kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    finally:
+        pages.put(None)
+
+
+def scan_all(table_name: str):
+    """Yield every item in a DynamoDB table as scan pages arrive.
+
+    Tables that fit in one page are read directly; larger tables are
+    re-scanned as SCAN_SEGMENTS parallel segments.
+    """
     table = boto3.resource("dynamodb", region_name=REGION).Table(table_name)
     resp = table.scan()
-    items = resp.get("Items", [])
-    while "LastEvaluatedKey" in resp:
-        resp = table.scan(ExclusiveStartKey=resp["LastEvaluatedKey"])
-        items.extend(resp.get("Items", []))
-    return items
+    if "LastEvaluatedKey" not in resp:
+        yield from resp.get("Items", [])
+        return
 
+    pages = queue.Queue()
+    with ThreadPoolExecutor(max_workers=SCAN_SEGMENTS) as pool:
+        futures = [pool.submit(_scan_segment, table_name, i, SCAN_SEGMENTS, pages) for i in range(SCAN_SEGMENTS)]
+        remaining = SCAN_SEGMENTS
+        while remaining:
+            page = pages.get()
+            if page is None:
+                remaining -= 1
+                continue
+            yield from page
+        for future in futures:
+            future.result()
 
-def print_routing_table():
+
+def print_routing_table(refresh: bool = False):
     """Print routing decisions grouped by source image."""
-    table_name = get_routing_table_name()
+    table_name = get_routing_table_name(refresh)
     if not table_name:
         print("ERROR: Adjuster stack not found. Deploy OarcWsAdjusterStack first.")
         sys.exit(1)
 
-    items = scan_all(table_name)
-    if not items:
-        print("No routing decisions found.")
-        return
-
-    # Group by source image
+    # Group by source image as scan pages arrive
+    items = []
     by_image = defaultdict(list)
-    for item in items:
+    decisions = defaultdict(int)
+    for item in scan_all(table_name):
+        items.append(item)
         src = item.get("source_image_uri", "unknown")
         # Just keep the filename
         key = src.split("/")[-1] if "/" in src else src
         by_image[key].append(item)
+        decisions[item.get("decision", "unknown")] += 1
+
+    if not items:
+        print("No routing decisions found.")
+        return
 
-    # Summary counts
     total = len(items)
-    decisions = defaultdict(int)
-    for item in items:
-        decisions[item.get("decision", "unknown")] += 1
 
     print(f"\n{'='*70}")
     print(f"  ADJUSTER ROUTING DECISIONS  ({total} total)")
@@ -96,13 +143,13 @@ def print_routing_table():
     os.makedirs(ADJUSTER_DIR, exist_ok=True)
     json_path = os.path.join(ADJUSTER_DIR, "routing_decisions.json")
     with open(json_path, "w") as f:
-        json.dump(items, f, indent=2, default=str)
+        json.dump(items, f, indent=2, default=_to_json)
     print(f"  Saved JSON: {json_path}")
 
 
 def sync_reports():
     """Download pipeline reports and adjuster artifacts from S3."""
-    s3 = boto3.client("s3", region_name=REGION)
+    s3 = aws_client("s3")
     os.makedirs(PIPELINE_DIR, exist_ok=True)
     os.makedirs(ADJUSTER_DIR, exist_ok=True)
 
@@ -140,11 +187,13 @@ def sync_reports():
 
 if __name__ == "__main__":
     args = sys.argv[1:]
-    show_table = "--table" in args or not args
-    show_sync = "--sync" in args or not args
+    refresh = "--refresh-cache" in args
+    modes = [a for a in args if a != "--refresh-cache"]
+    show_table = "--table" in modes or not modes
+    show_sync = "--sync" in modes or not modes
 
     if show_table:
-        print_routing_table()
+        print_routing_table(refresh)
     if show_sync:
         print(f"\n{'='*70}")
         print("  SYNCING REPORTS FROM S3")
@@ -1,13 +1,120 @@
-"""Workshop configuration - loaded from cdk.json. Edit values there."""
+"""Workshop configuration - loaded from cdk.json. Edit values there.
+
+Also provides shared boto3 clients for the scripts and a small on-disk cache
+for CloudFormation stack outputs, which only change on `cdk deploy`. Pass
+--refresh-cache to a script to bypass it.
+"""
+import hashlib
 import json
 import os
+import tempfile
+import time
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def _ctx() -> dict:
+    """Read the cdk.json context once, on first access to a setting."""
+    with open(os.path.join(os.path.dirname(__file__), "..", "cdk.json")) as f:
+        return json.load(f)["context"]
+
+
+# Module-level settings, resolved lazily through __getattr__ (PEP 562)
+_SETTINGS = {
+    "REGION": lambda ctx: ctx["region"],
+    "BUCKET_NAME": lambda ctx: ctx["bucket_name"],
+    "ENDPOINT_NAME": lambda ctx: ctx["endpoint_name"],
+    "STACK_NAME": lambda ctx: ctx["stack_name"],
+    "RESOURCE_PREFIX": lambda ctx: ctx["resource_prefix"],
+    "TAGS": lambda ctx: [{"Key": k, "Value": v} for k, v in ctx.get("tags", {}).items()],
+}
+
+
+def __getattr__(name: str):
+    if name in _SETTINGS:
+        return _SETTINGS[name](_ctx())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+STACK_OUTPUTS_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "oarc-ws", "stack-outputs.json")
+
+_CLIENTS = {}
+
+
+def aws_client(service: str, region: str = None):
+    """Return a boto3 client for (service, region), built once and reused.
+
+    region defaults to REGION from cdk.json.
+
+    Create clients from the main thread; the clients themselves are safe to share across threads.
+    """
+    key = (service, region or _ctx()["region"])
+    if key not in _CLIENTS:
+        import boto3
+        from botocore.config import Config
+
+        _CLIENTS[key] = boto3.client(
+            service,
+            region_name=key[1],
+            config=Config(max_pool_connections=32, retries={"mode": "adaptive"}),
+        )
+    return _CLIENTS[key]
+
+
+def _credential_identity() -> str:
+    """Identify the credential source from local config only, so no AWS call is made.
+
+    Uses the static AWS_ACCESS_KEY_ID when set, else the default session's profile
+    name (the session aws_client builds clients from). Switching either changes
+    the cache key, so cached outputs never leak across accounts.
+    """
+    access_key = os.environ.get("AWS_ACCESS_KEY_ID")
+    if access_key:
+        return "key:" + hashlib.sha256(access_key.encode("utf-8")).hexdigest()[:16]
+
+    import boto3
+
+    if boto3.DEFAULT_SESSION is None:
+        boto3.setup_default_session()
+    return f"profile:{boto3.DEFAULT_SESSION.profile_name}"
+
+
+def cached_stack_outputs(stack_name: str, region: str, ttl: int = 600, refresh: bool = False) -> dict:
+    """Return {OutputKey: OutputValue} for a stack, cached on disk for `ttl` seconds.
+
+    Returns {} if the stack does not exist (not cached, so a later deploy is picked up).
+    """
+    from botocore.exceptions import ClientError
+
+    cache_key = f"{_credential_identity()}/{region}/{stack_name}"
+    try:
+        with open(STACK_OUTPUTS_CACHE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    entry = cache.get(cache_key)
+    if not refresh and entry and time.time() - entry.get("fetched_at", 0) < ttl:
+        return entry["outputs"]
 
-with open(os.path.join(os.path.dirname(__file__), "..", "cdk.json")) as _f:
-    _CTX = json.load(_f)["context"]
+    cfn = aws_client("cloudformation", region)
+    try:
+        response = cfn.describe_stacks(StackName=stack_name)
+    except ClientError:
+        return {}
+    outputs = {o["OutputKey"]: o["OutputValue"] for o in response["Stacks"][0].get("Outputs", [])}
 
-REGION = _CTX["region"]
-BUCKET_NAME = _CTX["bucket_name"]
-ENDPOINT_NAME = _CTX["endpoint_name"]
-STACK_NAME = _CTX["stack_name"]
-RESOURCE_PREFIX = _CTX["resource_prefix"]
-TAGS = [{"Key": k, "Value": v} for k, v in _CTX.get("tags", {}).items()]
+    # Write atomically so concurrent script runs never see a partial file
+    now = time.time()
+    cache = {k: v for k, v in cache.items() if now - v.get("fetched_at", 0) < ttl}
+    cache[cache_key] = {"fetched_at": now, "outputs": outputs}
+    try:
+        cache_dir = os.path.dirname(STACK_OUTPUTS_CACHE)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, STACK_OUTPUTS_CACHE)
+    except OSError:
+        pass
+    return outputs
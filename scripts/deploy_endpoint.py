@@ -8,33 +8,31 @@ Usage:
     python scripts/deploy_endpoint.py create   # Create endpoint
     python scripts/deploy_endpoint.py delete   # Delete endpoint
     python scripts/deploy_endpoint.py status   # Check endpoint status
+
+Add --refresh-cache to re-read stack outputs after a `cdk deploy`.
+
+boto3/botocore are imported inside the functions that use them so that
+--help and argument errors return without loading the SDK.
 """
 import argparse
 import sys
 import time
 
-import boto3
-from botocore.exceptions import ClientError
-
-from config import REGION, ENDPOINT_NAME, STACK_NAME, TAGS, RESOURCE_PREFIX
+from config import REGION, ENDPOINT_NAME, STACK_NAME, TAGS, RESOURCE_PREFIX, aws_client, cached_stack_outputs
 
 INSTANCE_TYPE = "ml.g4dn.xlarge"
 
 
-def get_stack_outputs(stack_name: str, region: str) -> dict:
+def get_stack_outputs(stack_name: str, region: str, refresh: bool = False) -> dict:
     """Read CDK stack outputs to get bucket name and other config."""
-    cfn = boto3.client("cloudformation", region_name=region)
-    try:
-        response = cfn.describe_stacks(StackName=stack_name)
-        outputs = response["Stacks"][0].get("Outputs", [])
-        return {o["OutputKey"]: o["OutputValue"] for o in outputs}
-    except ClientError:
-        return {}
+    return cached_stack_outputs(stack_name, region, refresh=refresh)
 
 
-def create_endpoint(endpoint_name: str):
+def create_endpoint(endpoint_name: str, outputs: dict):
     """Create SageMaker Endpoint (model and config already exist in CDK stack)."""
-    sm = boto3.client("sagemaker", region_name=REGION)
+    from botocore.exceptions import ClientError, WaiterError
+
+    sm = aws_client("sagemaker")
 
     print(f"\n{'='*60}")
     print(f"  WARNING: This will create a SageMaker endpoint")
@@ -43,6 +41,7 @@ def create_endpoint(endpoint_name: str):
     print(f"  Auto-shutdown: enabled after 1 hour of inactivity")
     print(f"{'='*60}\n")
 
+    create = True
     try:
         response = sm.describe_endpoint(EndpointName=endpoint_name)
         status = response["EndpointStatus"]
@@ -56,63 +55,85 @@ def create_endpoint(endpoint_name: str):
             _wait_for_deletion(sm, endpoint_name)
         else:
             print("Waiting for current operation to complete...")
-            _wait_for_in_service(sm, endpoint_name)
-            return
+            create = False
     except ClientError:
         pass
 
-    print(f"Creating endpoint '{endpoint_name}'...")
-    outputs = get_stack_outputs(STACK_NAME, REGION)
-    config_name = outputs.get("EndpointConfigName")
-    if not config_name:
-        print("ERROR: EndpointConfigName not found in stack outputs. Run 'cdk deploy' first.")
-        sys.exit(1)
-    print(f"  Config: {config_name}")
+    if create:
+        print(f"Creating endpoint '{endpoint_name}'...")
+        config_name = outputs.get("EndpointConfigName")
+        if not config_name:
+            print("ERROR: EndpointConfigName not found in stack outputs. Run 'cdk deploy' first.")
+            sys.exit(1)
+        print(f"  Config: {config_name}")
+        try:
+            cfg = sm.describe_endpoint_config(EndpointConfigName=config_name)
+            print(f"  Model:  {cfg['ProductionVariants'][0]['ModelName']}")
+        except Exception:
+            pass
+        sm.create_endpoint(
+            EndpointName=endpoint_name,
+            EndpointConfigName=config_name,
+            Tags=TAGS,
+        )
+
+    print("Waiting for endpoint to be ready (this takes 5-10 minutes)...")
+    _poll_while(sm, endpoint_name, {"Creating", "Updating", "SystemUpdating"})
     try:
-        cfg = sm.describe_endpoint_config(EndpointConfigName=config_name)
-        print(f"  Model:  {cfg['ProductionVariants'][0]['ModelName']}")
-    except Exception:
-        pass
-    sm.create_endpoint(
-        EndpointName=endpoint_name,
-        EndpointConfigName=config_name,
-        Tags=TAGS,
-    )
-    _wait_for_in_service(sm, endpoint_name)
+        sm.get_waiter("endpoint_in_service").wait(
+            EndpointName=endpoint_name,
+            WaiterConfig={"Delay": 15, "MaxAttempts": 60},
+        )
+    except WaiterError as error:
+        reason = error.last_response.get("FailureReason", "unknown")
+        print(f"\nEndpoint creation failed: {reason}")
+        sys.exit(1)
+    print("\nEndpoint is ready!")
 
 
-def _wait_for_in_service(sm, endpoint_name: str):
-    """Poll endpoint status until InService or failure."""
-    print("Waiting for endpoint to be ready (this takes 5-10 minutes)...")
+def _poll_while(sm, endpoint_name: str, statuses: set):
+    """Print endpoint status with geometric backoff (2s up to 30s) while it is in `statuses`.
+
+    The matching SageMaker waiter is called afterwards to confirm the terminal state.
+    """
+    from botocore.exceptions import ClientError
+
+    delay = 2
     while True:
-        response = sm.describe_endpoint(EndpointName=endpoint_name)
-        status = response["EndpointStatus"]
+        try:
+            status = sm.describe_endpoint(EndpointName=endpoint_name)["EndpointStatus"]
+        except ClientError:
+            return
         print(f"  Status: {status}")
-        if status == "InService":
-            print("\nEndpoint is ready!")
+        if status not in statuses:
             return
-        if status == "Failed":
-            reason = response.get("FailureReason", "unknown")
-            print(f"\nEndpoint creation failed: {reason}")
-            sys.exit(1)
-        time.sleep(30)
+        time.sleep(delay)
+        delay = min(30, delay * 2)
 
 
 def _wait_for_deletion(sm, endpoint_name: str):
-    """Poll until endpoint no longer exists."""
+    """Block until the endpoint is gone; exit with its FailureReason if deletion fails."""
+    from botocore.exceptions import WaiterError
+
     print("Waiting for endpoint deletion...")
-    while True:
-        try:
-            sm.describe_endpoint(EndpointName=endpoint_name)
-            time.sleep(15)
-        except ClientError:
-            print("Endpoint deleted.")
-            return
+    _poll_while(sm, endpoint_name, {"Deleting"})
+    try:
+        sm.get_waiter("endpoint_deleted").wait(
+            EndpointName=endpoint_name,
+            WaiterConfig={"Delay": 15, "MaxAttempts": 60},
+        )
+    except WaiterError as error:
+        reason = error.last_response.get("FailureReason", "unknown")
+        print(f"Endpoint deletion failed: {reason}")
+        sys.exit(1)
+    print("Endpoint deleted.")
 
 
 def delete_endpoint():
     """Delete SageMaker Endpoint (model and config managed by CDK stack)."""
-    sm = boto3.client("sagemaker", region_name=REGION)
+    from botocore.exceptions import ClientError
+
+    sm = aws_client("sagemaker")
 
     try:
         sm.describe_endpoint(EndpointName=ENDPOINT_NAME)
@@ -125,10 +146,39 @@ def delete_endpoint():
     print("\nEndpoint deleted. Model and config remain (managed by CDK stack).")
 
 
+def _invocation_sums(cw, start_time, end_time, period: int):
+    """Return (timestamps, values) of InvocationsProcessed sums per period, newest first."""
+    response = cw.get_metric_data(
+        MetricDataQueries=[{
+            "Id": "invocations",
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": "AWS/SageMaker",
+                    "MetricName": "InvocationsProcessed",
+                    "Dimensions": [
+                        {"Name": "EndpointName", "Value": ENDPOINT_NAME},
+                        {"Name": "VariantName", "Value": "primary"}
+                    ],
+                },
+                "Period": period,
+                "Stat": "Sum",
+            },
+            "ReturnData": True,
+        }],
+        StartTime=start_time,
+        EndTime=end_time,
+        ScanBy="TimestampDescending",
+    )
+    result = response["MetricDataResults"][0]
+    return result["Timestamps"], result["Values"]
+
+
 def check_status():
     """Check the current status of the SageMaker endpoint."""
-    sm = boto3.client("sagemaker", region_name=REGION)
-    cw = boto3.client("cloudwatch", region_name=REGION)
+    from botocore.exceptions import ClientError
+
+    sm = aws_client("sagemaker")
+    cw = aws_client("cloudwatch")
 
     try:
         response = sm.describe_endpoint(EndpointName=ENDPOINT_NAME)
@@ -150,33 +200,28 @@ def check_status():
         print(f"Created:  {creation_time}")
 
         if status == "InService":
-            from datetime import datetime, timezone
+            from datetime import datetime, timedelta, timezone
             now = datetime.now(timezone.utc)
             hours = (now - creation_time).total_seconds() / 3600
             print(f"\nRuntime:  {hours:.2f} hours")
             print(f"Cost:     ${hours * 0.736:.2f}")
 
             try:
-                metric_response = cw.get_metric_statistics(
-                    Namespace="AWS/SageMaker",
-                    MetricName="InvocationsProcessed",
-                    Dimensions=[
-                        {"Name": "EndpointName", "Value": ENDPOINT_NAME},
-                        {"Name": "VariantName", "Value": "primary"}
-                    ],
-                    StartTime=creation_time,
-                    EndTime=now,
-                    Period=60,
-                    Statistics=["Sum"]
-                )
-                datapoints = sorted(metric_response.get("Datapoints", []), key=lambda x: x["Timestamp"])
-                last_invocation = next((dp["Timestamp"] for dp in reversed(datapoints) if dp["Sum"] > 0), None)
-                total_invocations = int(sum(dp["Sum"] for dp in datapoints))
+                # Only the recent window matters for idle time (auto-shutdown is 60 min);
+                # the lifetime total uses hourly sums so long-lived endpoints stay cheap to query
+                timestamps, values = _invocation_sums(cw, max(creation_time, now - timedelta(hours=2)), now, 60)
+                # Newest first, so the first non-zero value is the last invocation
+                last_invocation = next((ts for ts, v in zip(timestamps, values) if v > 0), None)
+                _, hourly = _invocation_sums(cw, creation_time, now, 3600)
+                total_invocations = int(sum(hourly))
                 if last_invocation:
                     idle_mins = (now - last_invocation).total_seconds() / 60
                     shutdown_mins = max(0, 60 - idle_mins)
                     print(f"Idle:     {idle_mins:.0f} min (last invocation: {last_invocation.strftime('%Y-%m-%d %H:%M:%S %Z')})")
                     print(f"Shutdown: ~{shutdown_mins:.0f} min remaining")
+                elif total_invocations:
+                    print("Idle:     over 2 hours")
+                    print(f"Shutdown: imminent (no recent activity detected)")
                 else:
                     print(f"Idle:     {hours:.2f} hours (no invocations)")
                     print(f"Shutdown: imminent (no activity detected)")
@@ -186,11 +231,12 @@ def check_status():
 
             # Alarm status
             try:
+                # One call for every workshop alarm; look up the ones we report on by name
                 alarm_name = f"{RESOURCE_PREFIX}-sagemaker-idle-endpoint"
-                alarm_resp = cw.describe_alarms(AlarmNames=[alarm_name])
-                alarms = alarm_resp.get("MetricAlarms", [])
-                if alarms:
-                    a = alarms[0]
+                alarm_resp = cw.describe_alarms(AlarmNamePrefix=f"{RESOURCE_PREFIX}-")
+                alarms = {a["AlarmName"]: a for a in alarm_resp.get("MetricAlarms", [])}
+                a = alarms.get(alarm_name)
+                if a:
                     print(f"\nAuto-shutdown alarm: {a['StateValue']}")
                     print(f"  Alarm:   {alarm_name}")
                     print(f"  Metric:  {a['MetricName']} (threshold < {int(a['Threshold'])} over {a['Period']//60}min)")
@@ -211,13 +257,14 @@ def check_status():
 def main():
     parser = argparse.ArgumentParser(description="Manage the SageMaker endpoint.")
     parser.add_argument("action", choices=["create", "delete", "status"])
-    action = parser.parse_args().action
-
-    outputs = get_stack_outputs(STACK_NAME, REGION)
-    endpoint = outputs.get("EndpointName", ENDPOINT_NAME)
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="Ignore cached stack outputs and re-read them from CloudFormation")
+    args = parser.parse_args()
+    action = args.action
 
     if action == "create":
-        create_endpoint(endpoint)
+        outputs = get_stack_outputs(STACK_NAME, REGION, refresh=args.refresh_cache)
+        create_endpoint(outputs.get("EndpointName", ENDPOINT_NAME), outputs)
     elif action == "delete":
         delete_endpoint()
     else:
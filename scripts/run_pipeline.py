@@ -5,47 +5,64 @@ For adjuster results, use adjuster_report.py instead.
 
 Usage:
     python scripts/run_pipeline.py
+    python scripts/run_pipeline.py --refresh-cache   # Re-read stack outputs
 
 Press Ctrl+C to stop watching.
 """
+import json
 import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from itertools import chain, islice
+from urllib.parse import unquote_plus
 
-import boto3
-from botocore.exceptions import ClientError
-
-from config import REGION, BUCKET_NAME, STACK_NAME
+from config import REGION, BUCKET_NAME, STACK_NAME, aws_client, cached_stack_outputs
 
 MARKDOWN_PREFIX = "markdown/"
-POLL_INTERVAL_SECONDS = 30
+# Poll quickly at first, back off while nothing arrives, reset when a report lands
+POLL_SCHEDULE_SECONDS = [2, 3, 5, 10, 15, 20, 30]
+UPLOAD_WORKERS = 16
+DOWNLOAD_WORKERS = 16
 
 
-def get_bucket_from_stack(region: str) -> str:
+def get_bucket_from_stack(region: str, refresh: bool = False) -> str:
     """Read bucket name from CDK stack outputs."""
-    cfn = boto3.client("cloudformation", region_name=region)
-    try:
-        response = cfn.describe_stacks(StackName=STACK_NAME)
-        for output in response["Stacks"][0].get("Outputs", []):
-            if output["OutputKey"] == "BucketName":
-                return output["OutputValue"]
-    except ClientError:
-        pass
-    return BUCKET_NAME
+    outputs = cached_stack_outputs(STACK_NAME, region, refresh=refresh)
+    return outputs.get("BucketName", BUCKET_NAME)
+
+
+def get_report_queue_url(region: str, refresh: bool = False):
+    """Read the report-events SQS queue URL from CDK stack outputs (None if not deployed)."""
+    return cached_stack_outputs(STACK_NAME, region, refresh=refresh).get("ReportQueueUrl")
 
 
-def upload_test_data(bucket: str, region: str):
-    """Upload images and test input files to S3."""
-    s3_client = boto3.client("s3", region_name=region)
+def _upload_files(s3_client, bucket: str, uploads: list):
+    """Upload (local_path, s3_key) pairs concurrently, yielding each key as it completes."""
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        futures = {
+            pool.submit(s3_client.upload_file, local_path, bucket, s3_key): s3_key
+            for local_path, s3_key in uploads
+        }
+        for future in as_completed(futures):
+            future.result()
+            yield futures[future]
 
-    # Upload images first
+
+def upload_test_data(bucket: str, region: str) -> list:
+    """Upload images and test input files to S3. Returns the local input paths uploaded."""
+    s3_client = aws_client("s3", region)
+
+    # Upload images first (inputs reference them)
     images_dir = os.path.join(os.path.dirname(__file__), "..", "files", "images")
     if os.path.exists(images_dir):
-        image_files = sorted(os.listdir(images_dir))
-        print(f"Uploading {len(image_files)} image(s) to s3://{bucket}/images/")
-        for filename in image_files:
-            s3_client.upload_file(os.path.join(images_dir, filename), bucket, f"images/{filename}")
-            print(f"  {filename}")
+        with os.scandir(images_dir) as it:
+            image_entries = sorted((e for e in it if e.is_file()), key=lambda e: e.name)
+        print(f"Uploading {len(image_entries)} image(s) to s3://{bucket}/images/")
+        uploads = [(e.path, f"images/{e.name}") for e in image_entries]
+        for s3_key in _upload_files(s3_client, bucket, uploads):
+            print(f"  {os.path.basename(s3_key)}")
         print()
 
     # Find input files
@@ -53,44 +70,130 @@ def upload_test_data(bucket: str, region: str):
 
     if not os.path.exists(inputs_dir):
         print(f"ERROR: Input directory not found: {inputs_dir}")
-        return 0
+        return []
 
-    input_files = [f for f in os.listdir(inputs_dir) if f.endswith(".json")]
+    with os.scandir(inputs_dir) as it:
+        input_entries = sorted((e for e in it if e.is_file() and e.name.endswith(".json")), key=lambda e: e.name)
 
-    if not input_files:
+    if not input_entries:
         print(f"ERROR: No JSON files found in {inputs_dir}")
-        return 0
+        return []
+
+    print(f"Uploading {len(input_entries)} input file(s) to s3://{bucket}/inputs/\n")
 
-    print(f"Uploading {len(input_files)} input file(s) to s3://{bucket}/inputs/\n")
+    # Each object gets its own Object Created event, and so its own Step Functions execution
+    uploads = [(e.path, f"inputs/{e.name}") for e in input_entries]
+    for i, s3_key in enumerate(_upload_files(s3_client, bucket, uploads), 1):
+        print(f"[{i}/{len(input_entries)}] Uploaded {os.path.basename(s3_key)}")
 
-    for i, filename in enumerate(sorted(input_files), 1):
-        local_path = os.path.join(inputs_dir, filename)
-        s3_key = f"inputs/{filename}"
+    print(f"\nUploaded {len(input_entries)} file(s). Pipeline executions starting...\n")
+    return [local_path for local_path, _ in uploads]
 
-        print(f"[{i}/{len(input_files)}] Uploading {filename}...")
-        s3_client.upload_file(local_path, bucket, s3_key)
 
-        # Add delay between uploads to trigger separate executions
-        if i < len(input_files):
-            time.sleep(5)
+def _report_prefix(input_path: str) -> str:
+    """Markdown key prefix the processor Lambda will use for this input's report.
 
-    print(f"\nUploaded {len(input_files)} file(s). Pipeline executions starting...\n")
-    return len(input_files)
+    Mirrors process_sam3_analysis: "1-before.png" -> "markdown/palisades-fire-1--<UTC timestamp>.md".
+    Keys sharing this prefix sort chronologically, so they can be listed with StartAfter.
+    """
+    with open(input_path) as f:
+        before = json.load(f).get("before", "")
+    if not before:
+        return MARKDOWN_PREFIX
+    name = os.path.splitext(os.path.basename(before))[0].replace("-before", "").replace("_before", "")
+    return f"{MARKDOWN_PREFIX}palisades-fire-{name}--"
 
 
-def list_markdown_keys(s3_client, bucket: str) -> set:
-    """List all object keys under the markdown/ prefix."""
-    keys = set()
+def iter_markdown_keys(s3_client, bucket: str, prefix: str = MARKDOWN_PREFIX, start_after: str = None):
+    """Yield object keys under a markdown/ prefix as pages arrive, optionally only those after start_after."""
     paginator = s3_client.get_paginator("list_objects_v2")
-    for page in paginator.paginate(Bucket=bucket, Prefix=MARKDOWN_PREFIX):
+    params = {"Bucket": bucket, "Prefix": prefix}
+    if start_after:
+        params["StartAfter"] = start_after
+    for page in paginator.paginate(**params):
         for obj in page.get("Contents", []):
-            keys.add(obj["Key"])
-    return keys
-
-
-def watch_for_results(bucket: str, region: str, expected_count: int):
-    """Watch for new markdown reports in S3."""
-    s3_client = boto3.client("s3", region_name=region)
+            yield obj["Key"]
+
+
+def _poll_for_keys(s3_client, bucket: str, known: set, prefixes: set, expected_count: int):
+    """Yield batches of markdown keys not yet in `known`, listing S3 on an adaptive interval.
+
+    Report keys are only time-ordered within one prefix, so each prefix is listed from
+    its own newest known key rather than from max(known). Listing stops as soon as
+    expected_count new keys have been found, without fetching further pages.
+    """
+    if MARKDOWN_PREFIX in prefixes:
+        prefixes = {MARKDOWN_PREFIX}
+    latest = {p: max((k for k in known if k.startswith(p)), default=None) for p in prefixes}
+
+    def new_keys_under(prefix):
+        for key in iter_markdown_keys(s3_client, bucket, prefix, start_after=latest[prefix]):
+            latest[prefix] = key
+            if key not in known:
+                yield key
+
+    remaining = expected_count
+    step = 0
+    while remaining > 0:
+        time.sleep(POLL_SCHEDULE_SECONDS[min(step, len(POLL_SCHEDULE_SECONDS) - 1)])
+        new_keys = list(islice(chain.from_iterable(new_keys_under(p) for p in sorted(prefixes)), remaining))
+        remaining -= len(new_keys)
+        step = 0 if new_keys else step + 1
+        yield new_keys
+
+
+def _receive_keys(sqs_client, queue_url: str):
+    """Yield (keys, ack) batches from S3 Object Created events delivered to SQS.
+
+    Call ack() once the batch's reports are saved; unacknowledged messages are
+    redelivered after the visibility timeout.
+    """
+    while True:
+        response = sqs_client.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=20,
+        )
+        messages = response.get("Messages", [])
+        keys = []
+        for message in messages:
+            event = json.loads(message["Body"])
+            # EventBridge S3 events carry URL-encoded object keys
+            keys.append(unquote_plus(event["detail"]["object"]["key"]))
+
+        def ack(messages=messages):
+            if messages:
+                sqs_client.delete_message_batch(
+                    QueueUrl=queue_url,
+                    Entries=[{"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]} for i, m in enumerate(messages)],
+                )
+
+        yield sorted(keys), ack
+
+
+@lru_cache(maxsize=1)
+def _transfer_config():
+    """S3 TransferConfig shared by all report downloads (boto3 imported on first use)."""
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=8)
+
+
+def _save_report(s3_client, bucket: str, key: str, reports_dir: str) -> str:
+    """Stream one markdown report to disk in reports_dir and return the local path."""
+    local_path = os.path.join(reports_dir, os.path.basename(key))
+    s3_client.download_file(bucket, key, local_path, Config=_transfer_config())
+    return local_path
+
+
+def watch_for_results(bucket: str, region: str, expected_count: int, queue_url: str = None,
+                      report_prefixes: set = None):
+    """Watch for new markdown reports in S3.
+
+    Uses the report-events SQS queue when it is deployed, otherwise polls S3
+    (only under report_prefixes, if given).
+    """
+    s3_client = aws_client("s3", region)
 
     script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     reports_dir = os.path.join(script_dir, "files", "reports", "pipeline")
@@ -98,49 +201,54 @@ def watch_for_results(bucket: str, region: str, expected_count: int):
 
     print(f"Watching for {expected_count} report(s) in s3://{bucket}/{MARKDOWN_PREFIX}")
     print(f"Saving to: {reports_dir}")
-    print(f"Poll interval: {POLL_INTERVAL_SECONDS}s. Press Ctrl+C to stop.\n")
+    if queue_url:
+        print(f"Listening on SQS queue: {queue_url}. Press Ctrl+C to stop.\n")
+    else:
+        print(f"Poll interval: {POLL_SCHEDULE_SECONDS[0]}-{POLL_SCHEDULE_SECONDS[-1]}s (adaptive). Press Ctrl+C to stop.\n")
 
-    known = list_markdown_keys(s3_client, bucket)
+    known = set(iter_markdown_keys(s3_client, bucket))
     print(f"Found {len(known)} existing report(s).\n")
 
     # Download any existing reports not already saved locally
     existing_files = set(os.listdir(reports_dir))
-    for key in known:
-        filename = os.path.basename(key)
-        if filename not in existing_files:
-            response = s3_client.get_object(Bucket=bucket, Key=key)
-            content = response["Body"].read().decode()
-            with open(os.path.join(reports_dir, filename), "w") as f:
-                f.write(content)
+    to_download = [k for k in known if os.path.basename(k) not in existing_files]
+    if to_download:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            list(pool.map(lambda k: _save_report(s3_client, bucket, k, reports_dir), to_download))
+
+    if queue_url:
+        batches = _receive_keys(aws_client("sqs", region), queue_url)
+    else:
+        polled = _poll_for_keys(s3_client, bucket, known, report_prefixes or {MARKDOWN_PREFIX}, expected_count)
+        batches = ((keys, None) for keys in polled)
 
     received = 0
 
     try:
-        while received < expected_count:
-            time.sleep(POLL_INTERVAL_SECONDS)
-
-            current = list_markdown_keys(s3_client, bucket)
-            new_keys = current - known
-
-            if new_keys:
-                for key in sorted(new_keys):
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            for batch, ack in batches:
+                # Queued events can predate the initial listing; skip anything already seen
+                new_keys = [k for k in batch if k not in known]
+                if not new_keys:
+                    if ack:
+                        ack()
+                    print(f"  Waiting... ({received}/{expected_count} reports)")
+                    continue
+
+                local_paths = pool.map(lambda k: _save_report(s3_client, bucket, k, reports_dir), new_keys)
+                for key, local_path in zip(new_keys, local_paths):
+                    known.add(key)
                     received += 1
                     print(f"\n{'='*60}")
                     print(f"  NEW REPORT ({received}/{expected_count}): {key}")
                     print(f"{'='*60}\n")
-
-                    response = s3_client.get_object(Bucket=bucket, Key=key)
-                    content = response["Body"].read().decode()
-
-                    filename = os.path.basename(key)
-                    local_path = os.path.join(reports_dir, filename)
-                    with open(local_path, "w") as f:
-                        f.write(content)
                     print(f"Saved to: {local_path}")
+                # Only drop the events once every report in the batch is on disk
+                if ack:
+                    ack()
 
-                known = current
-            else:
-                print(f"  Waiting... ({received}/{expected_count} reports)")
+                if received >= expected_count:
+                    break
 
         print(f"\n{'='*60}")
         print(f"  All {expected_count} report(s) received!")
@@ -153,11 +261,13 @@ def watch_for_results(bucket: str, region: str, expected_count: int):
 
 
 def main():
-    bucket = get_bucket_from_stack(REGION)
-    count = upload_test_data(bucket, REGION)
-    if count == 0:
+    refresh = "--refresh-cache" in sys.argv[1:]
+    bucket = get_bucket_from_stack(REGION, refresh=refresh)
+    queue_url = get_report_queue_url(REGION)
+    inputs = upload_test_data(bucket, REGION)
+    if not inputs:
         sys.exit(1)
-    watch_for_results(bucket, REGION, count)
+    watch_for_results(bucket, REGION, len(inputs), queue_url, {_report_prefix(p) for p in inputs})
 
 
 if __name__ == "__main__":
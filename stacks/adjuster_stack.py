@@ -19,6 +19,7 @@ class OarcWsAdjusterStack(cdk.Stack):
         bucket_name = self.node.try_get_context("bucket_name")
         model_id = self.node.try_get_context("adjuster_model_id") or self.node.try_get_context("bedrock_model_id")
         prefix = self.node.try_get_context("resource_prefix")
+        latency = self.node.try_get_context("adjuster_latency") or "standard"
 
         # Reference existing S3 bucket
         bucket = s3.Bucket.from_bucket_name(self, "Bucket", bucket_name)
@@ -47,6 +48,7 @@ class OarcWsAdjusterStack(cdk.Stack):
             environment={
                 "ROUTING_TABLE_NAME": routing_table.table_name,
                 "BEDROCK_MODEL_ID": model_id,
+                "BEDROCK_LATENCY": latency,
             },
         )
 
@@ -57,7 +59,7 @@ class OarcWsAdjusterStack(cdk.Stack):
         # Scope Bedrock to specific model
         adjuster_lambda.add_to_role_policy(
             iam.PolicyStatement(
-                actions=["bedrock:InvokeModel"],
+                actions=["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"],
                 resources=[
                     f"arn:{self.partition}:bedrock:*::foundation-model/{model_id}",
                     f"arn:{self.partition}:bedrock:*::foundation-model/{model_id.removeprefix('us.')}",
@@ -2,13 +2,19 @@ import base64
 import io
 import json
 import logging
+import math
 import os
-import re
+import string
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from urllib.parse import unquote_plus
 from datetime import datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
+from operator import itemgetter
 from typing import Any, Dict, List, Optional, Tuple
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 try:
@@ -22,21 +28,41 @@ except Exception:
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3 = boto3.client("s3")
-from botocore.config import Config
+# Crop/annotation encodes and uploads run concurrently; the connection pool must cover them
+S3_UPLOAD_WORKERS = int(os.environ.get("S3_UPLOAD_WORKERS", "16"))
+
+# Shared by all clients: keep connections warm across invocations, retry throttling adaptively
+_CLIENT_CONFIG = Config(
+    max_pool_connections=max(50, S3_UPLOAD_WORKERS),
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 5},
+)
+
+s3 = boto3.client("s3", config=_CLIENT_CONFIG)
+bedrock = boto3.client("bedrock-runtime", config=_CLIENT_CONFIG.merge(Config(read_timeout=600)))
+dynamodb = boto3.resource("dynamodb", config=_CLIENT_CONFIG)
 
-bedrock = boto3.client("bedrock-runtime", config=Config(read_timeout=600))
-dynamodb = boto3.resource("dynamodb")
+# Lives for the container so warm invocations reuse its threads
+_ARTIFACT_POOL = ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS)
 
 
 MODEL_ID = os.environ.get("BEDROCK_MODEL_ID", "us.anthropic.claude-sonnet-4-20250514-v1:0")
+# "optimized" routes to latency-optimized inference where the model supports it
+BEDROCK_LATENCY = os.environ.get("BEDROCK_LATENCY", "standard")
 ROUTING_TABLE_NAME = os.environ["ROUTING_TABLE_NAME"]
 
 table = dynamodb.Table(ROUTING_TABLE_NAME)
 
+# Claude downsamples anything larger server-side, so larger images only add upload and prefill time
+MODEL_MAX_IMAGE_EDGE = 1568
 
+# Stands in for the image data while the payload is serialized; see _build_bedrock_body
+_IMAGE_DATA_PLACEHOLDER = "__IMAGE_BASE64__"
+
+
+@lru_cache(maxsize=1)
 def _load_prompt() -> str:
-    """Load prompt from local prompt.txt file."""
+    """Load prompt from local prompt.txt file (once per container; it ships in the image)."""
     prompt_path = os.path.join(os.path.dirname(__file__), "prompt.txt")
     try:
         with open(prompt_path, "r") as f:
@@ -106,6 +132,22 @@ def _base_prompt() -> str:
     )
 
 
+def _downscale_for_model(image_bytes: bytes, max_edge: int = MODEL_MAX_IMAGE_EDGE) -> bytes:
+    """Shrink the long edge to max_edge for the model call (bboxes are normalized, so unaffected)."""
+    if not PIL_AVAILABLE:
+        return image_bytes
+
+    img = Image.open(io.BytesIO(image_bytes))
+    if max(img.size) <= max_edge:
+        return image_bytes
+
+    img = img.convert("RGB")
+    img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
 def _resize_image(image_bytes: bytes, max_size_bytes: int = 3_900_000) -> bytes:
     """Resize an image to fit within the Bedrock API size limit (5MB after base64 encoding)."""
     if len(image_bytes) <= max_size_bytes:
@@ -130,7 +172,19 @@ def _resize_image(image_bytes: bytes, max_size_bytes: int = 3_900_000) -> bytes:
             return buf.getvalue()
 
 
+def _build_bedrock_body(payload: Dict[str, Any], image_bytes: bytes) -> bytes:
+    """Serialize payload, splicing base64 image bytes in place of _IMAGE_DATA_PLACEHOLDER.
+
+    Base64 output needs no JSON escaping, so the multi-MB image string skips the
+    str decode and json.dumps passes entirely.
+    """
+    head, tail = json.dumps(payload).encode("utf-8").split(_IMAGE_DATA_PLACEHOLDER.encode("utf-8"), 1)
+    return b"".join((head, base64.b64encode(image_bytes), tail))
+
+
 def _invoke_bedrock(image_bytes: bytes, image_key: str, prompt_text: str) -> Dict[str, Any]:
+    # Full-resolution bytes are kept by the caller for crops; only the model sees the smaller copy
+    image_bytes = _downscale_for_model(image_bytes)
     # Resize if needed (same logic as processor Lambda)
     image_bytes = _resize_image(image_bytes)
     media_type = "image/jpeg" if image_bytes[0:2] == b'\xff\xd8' else "image/png"
@@ -138,37 +192,63 @@ def _invoke_bedrock(image_bytes: bytes, image_key: str, prompt_text: str) -> Dic
     payload = {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": 32000,
+        # Static instructions live in the system prompt so the cacheable prefix is kept apart from the image turn
+        "system": [{"type": "text", "text": prompt_text, "cache_control": {"type": "ephemeral"}}],
         "messages": [
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": prompt_text},
                     {
                         "type": "image",
                         "source": {
                             "type": "base64",
                             "media_type": media_type,
-                            "data": base64.b64encode(image_bytes).decode("utf-8"),
+                            "data": _IMAGE_DATA_PLACEHOLDER,
                         },
                     },
+                    {"type": "text", "text": "Analyze this image."},
                 ],
             }
         ],
     }
 
-    logger.info("Calling Bedrock (max_tokens=32000, image_size=%d bytes)", len(image_bytes))
-    response = bedrock.invoke_model(modelId=MODEL_ID, body=json.dumps(payload))
-    body = json.loads(response["body"].read())
-    stop_reason = str(body.get("stop_reason", "unknown"))
-    logger.info("Bedrock responded (stop_reason=%s)", stop_reason)
+    logger.info(
+        "Calling Bedrock (max_tokens=32000, image_size=%d bytes, latency=%s)",
+        len(image_bytes),
+        BEDROCK_LATENCY,
+    )
+    response = bedrock.invoke_model_with_response_stream(
+        modelId=MODEL_ID,
+        body=_build_bedrock_body(payload, image_bytes),
+        performanceConfigLatency=BEDROCK_LATENCY,
+    )
+
+    # Accumulate text deltas as they are generated rather than waiting for the full body
+    text = io.StringIO()
+    stop_reason = "unknown"
+    usage: Dict[str, Any] = {}
+    for event in response["body"]:
+        chunk = event.get("chunk")
+        if not chunk:
+            continue
+        message = json.loads(chunk["bytes"])
+        if message.get("type") == "content_block_delta" and message["delta"].get("type") == "text_delta":
+            text.write(message["delta"]["text"])
+        elif message.get("type") == "message_start":
+            usage = message.get("message", {}).get("usage", {})
+        elif message.get("type") == "message_delta":
+            stop_reason = str(message["delta"].get("stop_reason", stop_reason))
+    logger.info(
+        "Bedrock responded (stop_reason=%s, input_tokens=%s, cache_read=%s, cache_write=%s)",
+        stop_reason,
+        usage.get("input_tokens"),
+        usage.get("cache_read_input_tokens"),
+        usage.get("cache_creation_input_tokens"),
+    )
 
-    text_chunks = [
-        item.get("text", "")
-        for item in body.get("content", [])
-        if item.get("type") == "text"
-    ]
-    model_text = "\n".join(text_chunks).strip()
-    cleaned = model_text.replace("```json", "").replace("```", "").strip()
+    model_text = text.getvalue().strip()
+    # Fences only ever wrap the body, so trim the ends rather than rewriting the whole text
+    cleaned = model_text.removeprefix("```json").removeprefix("```").removesuffix("```").strip()
 
     try:
         return json.loads(cleaned)
@@ -180,11 +260,13 @@ def _invoke_bedrock(image_bytes: bytes, image_key: str, prompt_text: str) -> Dic
 def _normalize_decisions(raw: Dict[str, Any]) -> Dict[str, Any]:
     homes: List[Dict[str, Any]] = raw.get("homes", []) if isinstance(raw, dict) else []
     normalized: List[Dict[str, Any]] = []
+    auto_count = 0
 
     for idx, home in enumerate(homes, start=1):
         decision = str(home.get("decision", "")).strip().lower()
         if decision not in {"auto_approved", "needs_human_review"}:
             decision = "needs_human_review"
+        auto_count += decision == "auto_approved"
 
         house_id = str(home.get("house_id", f"house-{idx:03d}"))
         inclusion = home.get("has_5ft_inclusion_zone", None)
@@ -195,6 +277,9 @@ def _normalize_decisions(raw: Dict[str, Any]) -> Dict[str, Any]:
             confidence = float(confidence_raw)
         except (TypeError, ValueError):
             confidence = 0.0
+        if not math.isfinite(confidence):
+            # DynamoDB numbers cannot hold NaN/Infinity
+            confidence = 0.0
 
         reason = str(home.get("reason", "No reason provided by model"))
 
@@ -209,8 +294,8 @@ def _normalize_decisions(raw: Dict[str, Any]) -> Dict[str, Any]:
             }
         )
 
-    auto_count = len([h for h in normalized if h["decision"] == "auto_approved"])
-    review_count = len([h for h in normalized if h["decision"] == "needs_human_review"])
+    # Every decision is one of the two values, so the rest need review
+    review_count = len(normalized) - auto_count
 
     return {
         "summary": {
@@ -252,16 +337,35 @@ def _normalize_bbox(raw_bbox: Any) -> Optional[Dict[str, float]]:
     }
 
 
+class _KeyComponentTable(dict):
+    """str.translate table: keeps [A-Za-z0-9._-], maps every other code point to "_"."""
+
+    _ALLOWED = frozenset(string.ascii_letters + string.digits + "._-")
+
+    def __missing__(self, codepoint: int) -> Any:
+        replacement = codepoint if chr(codepoint) in self._ALLOWED else "_"
+        self[codepoint] = replacement
+        return replacement
+
+
+_KEY_COMPONENT_TABLE = _KeyComponentTable()
+
+
 def _sanitize_key_component(value: str) -> str:
-    cleaned = re.sub(r"[^A-Za-z0-9._-]", "_", value)
+    cleaned = value.translate(_KEY_COMPONENT_TABLE)
     return cleaned[:120] or "home"
 
 
+# One C-level call unpacks all four corners instead of four separate dict lookups
+_bbox_corners = itemgetter("x_min", "y_min", "x_max", "y_max")
+
+
 def _bbox_to_pixel_box(bbox: Dict[str, float], width: int, height: int) -> Tuple[int, int, int, int]:
-    left = int(bbox["x_min"] * width)
-    top = int(bbox["y_min"] * height)
-    right = int(bbox["x_max"] * width)
-    bottom = int(bbox["y_max"] * height)
+    x_min, y_min, x_max, y_max = _bbox_corners(bbox)
+    left = int(x_min * width)
+    top = int(y_min * height)
+    right = int(x_max * width)
+    bottom = int(y_max * height)
 
     left = max(0, min(width - 1, left))
     top = max(0, min(height - 1, top))
@@ -270,23 +374,44 @@ def _bbox_to_pixel_box(bbox: Dict[str, float], width: int, height: int) -> Tuple
     return left, top, right, bottom
 
 
-def _bbox_to_dynamodb_map(bbox: Optional[Dict[str, float]]) -> Optional[Dict[str, str]]:
+def _bbox_to_dynamodb_map(bbox: Optional[Dict[str, float]]) -> Optional[Dict[str, Decimal]]:
     if not bbox:
         return None
+    # str() round-trip keeps the 6-decimal value exact instead of the float's binary expansion
     return {
-        "x_min": str(bbox["x_min"]),
-        "y_min": str(bbox["y_min"]),
-        "x_max": str(bbox["x_max"]),
-        "y_max": str(bbox["y_max"]),
+        "x_min": Decimal(str(bbox["x_min"])),
+        "y_min": Decimal(str(bbox["y_min"])),
+        "x_max": Decimal(str(bbox["x_max"])),
+        "y_max": Decimal(str(bbox["y_max"])),
     }
 
 
+def _upload_image(bucket: str, key: str, image: Any, image_format: str, **save_options: Any) -> None:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **save_options)
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=buffer.getvalue(),
+        ContentType=_guess_media_type(key),
+    )
+
+
 def _save_visual_artifacts(
     bucket: str,
     image_key: str,
     image_bytes: bytes,
     normalized: Dict[str, Any],
 ) -> Tuple[Optional[str], Dict[str, str]]:
+    """Cut crops and draw annotations, uploading them concurrently on _ARTIFACT_POOL.
+
+    Returns the artifact URIs only once every upload has succeeded.
+    """
+    homes = normalized.get("homes", [])
+    if not any(home.get("bbox") for home in homes):
+        # Nothing to crop or draw: skip the decode and the empty annotated upload
+        return None, {}
+
     if not PIL_AVAILABLE:
         logger.warning("Pillow is unavailable; skipping crop/annotation artifact generation")
         return None, {}
@@ -298,50 +423,51 @@ def _save_visual_artifacts(
         return None, {}
 
     width, height = base_image.size
-    annotated_image = base_image.copy()
-    draw = ImageDraw.Draw(annotated_image)
     line_width = max(2, width // 400)
 
     crop_uris: Dict[str, str] = {}
+    uploads: List[Future] = []
+    boxes = []
 
-    for home in normalized.get("homes", []):
-        house_id = str(home.get("house_id", "unknown"))
-        bbox = home.get("bbox")
-        if not bbox:
-            continue
-
-        left, top, right, bottom = _bbox_to_pixel_box(bbox, width, height)
-        crop = base_image.crop((left, top, right, bottom))
-
-        safe_house_id = _sanitize_key_component(house_id)
-        crop_key = f"routing-artifacts/crops/{image_key}/{safe_house_id}.png"
-
-        crop_bytes = io.BytesIO()
-        crop.save(crop_bytes, format="PNG")
-        s3.put_object(
-            Bucket=bucket,
-            Key=crop_key,
-            Body=crop_bytes.getvalue(),
-            ContentType="image/png",
+    try:
+        # Encodes and S3 PUTs overlap in the pool
+        for home in homes:
+            house_id = str(home.get("house_id", "unknown"))
+            bbox = home.get("bbox")
+            if not bbox:
+                continue
+
+            left, top, right, bottom = _bbox_to_pixel_box(bbox, width, height)
+
+            safe_house_id = _sanitize_key_component(house_id)
+            crop_key = f"routing-artifacts/crops/{image_key}/{safe_house_id}.jpg"
+
+            crop = base_image.crop((left, top, right, bottom))
+            uploads.append(_ARTIFACT_POOL.submit(_upload_image, bucket, crop_key, crop, "JPEG", quality=85))
+            crop_uris[house_id] = f"s3://{bucket}/{crop_key}"
+            boxes.append((house_id, str(home.get("decision", "needs_human_review")), (left, top, right, bottom)))
+
+        # Every crop is already its own copy, so annotate the decoded image in place
+        # instead of keeping a second full-size copy for drawing
+        annotated_image = base_image
+        draw = ImageDraw.Draw(annotated_image)
+        for house_id, decision, (left, top, right, bottom) in boxes:
+            color = "green" if decision == "auto_approved" else "red"
+            draw.rectangle((left, top, right, bottom), outline=color, width=line_width)
+            label = f"{house_id} {decision}"
+            label_top = max(0, top - 14)
+            draw.text((left + 2, label_top), label, fill=color)
+
+        # WebP keeps the drawn boxes and labels sharp at a fraction of PNG's size and encode time
+        annotated_key = f"routing-artifacts/annotated/{image_key}.annotated.webp"
+        uploads.append(
+            _ARTIFACT_POOL.submit(_upload_image, bucket, annotated_key, annotated_image, "WEBP", quality=90, method=4)
         )
-        crop_uris[house_id] = f"s3://{bucket}/{crop_key}"
-
-        decision = str(home.get("decision", "needs_human_review"))
-        color = "green" if decision == "auto_approved" else "red"
-        draw.rectangle((left, top, right, bottom), outline=color, width=line_width)
-        label = f"{house_id} {decision}"
-        label_top = max(0, top - 14)
-        draw.text((left + 2, label_top), label, fill=color)
-
-    annotated_key = f"routing-artifacts/annotated/{image_key}.annotated.png"
-    annotated_bytes = io.BytesIO()
-    annotated_image.save(annotated_bytes, format="PNG")
-    s3.put_object(
-        Bucket=bucket,
-        Key=annotated_key,
-        Body=annotated_bytes.getvalue(),
-        ContentType="image/png",
-    )
+    finally:
+        # No upload may outlive the invocation, even if drawing fails part-way
+        wait(uploads)
+    for upload in uploads:
+        upload.result()
 
     return f"s3://{bucket}/{annotated_key}", crop_uris
 
@@ -365,7 +491,7 @@ def _write_routing_results(
                     "house_id": home["house_id"],
                     "decision": home["decision"],
                     "has_5ft_inclusion_zone": home["has_5ft_inclusion_zone"],
-                    "confidence": str(home["confidence"]),
+                    "confidence": Decimal(str(round(home["confidence"], 4))),
                     "reason": home["reason"],
                     "bbox": _bbox_to_dynamodb_map(home.get("bbox")),
                     "home_crop_s3_uri": crop_uris.get(home["house_id"]),
@@ -408,7 +534,6 @@ def lambda_handler(event: Dict[str, Any], _context: Any) -> Dict[str, Any]:
         raw_model_output = _invoke_bedrock(image_bytes, key, prompt_text)
         normalized = _normalize_decisions(raw_model_output)
         annotated_image_s3_uri, crop_uris = _save_visual_artifacts(bucket, key, image_bytes, normalized)
-
         _write_routing_results(bucket, key, normalized, annotated_image_s3_uri, crop_uris)
 
         logger.info("Processed %s: %s", key, normalized["summary"])
@@ -21,6 +21,7 @@ from aws_cdk import (
     aws_stepfunctions_tasks as sfn_tasks,
     aws_logs as logs,
     aws_sagemaker as sagemaker,
+    aws_sqs as sqs,
 )
 
 LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "lambda_functions")
@@ -213,6 +214,27 @@ class PipelineStack(cdk.Stack):
             targets=[events_targets.SfnStateMachine(state_machine)],
         )
 
+        # Report notifications - scripts/run_pipeline.py long-polls this queue
+        # instead of re-listing markdown/ in S3
+        report_queue = sqs.Queue(
+            self, "ReportEventsQueue",
+            queue_name=f"{prefix}-report-events",
+            retention_period=cdk.Duration.hours(1),
+        )
+        events.Rule(
+            self, "ReportCreatedRule",
+            rule_name=f"{prefix}-report-created",
+            event_pattern=events.EventPattern(
+                source=["aws.s3"],
+                detail_type=["Object Created"],
+                detail={
+                    "bucket": {"name": [bucket_name]},
+                    "object": {"key": [{"wildcard": "markdown/*"}]},
+                },
+            ),
+            targets=[events_targets.SqsQueue(report_queue)],
+        )
+
         # -----------------------------------------------------------
         # SageMaker Model + EndpointConfig (no cost, created once)
         # -----------------------------------------------------------
@@ -280,6 +302,7 @@ class PipelineStack(cdk.Stack):
         cdk.CfnOutput(self, "StateMachineArn", value=state_machine.state_machine_arn)
         cdk.CfnOutput(self, "EndpointName", value=endpoint_name)
         cdk.CfnOutput(self, "EndpointConfigName", value=sm_endpoint_config.attr_endpoint_config_name)
+        cdk.CfnOutput(self, "ReportQueueUrl", value=report_queue.queue_url)
         cdk.CfnOutput(self, "CostWarning",
                        value="WARNING: SageMaker endpoint costs ~$0.736/hr (~$530/month). "
                              "Auto-shutdown after 1hr inactivity. Daily cleanup at 2AM UTC.")